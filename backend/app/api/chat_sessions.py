@@ -4,7 +4,6 @@ Chat Sessions API — full CRUD + synthesize flow
 import asyncio
 import json
 import logging
-import os
 import re
 
 import anthropic
@@ -14,12 +13,13 @@ from typing import Optional
 
 from app.api.auth import get_current_user
 from app.models.chat_session import ChatSession
+from app.services import anthropic_client
 from app.services.chat_session_storage import save_session, load_session, update_session
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-client_anthropic = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+client_anthropic = anthropic_client.get_client()
 
 QUESTION_PROMPT_TEMPLATE = """你是一個專業的寫作教練，擅長幫助社群媒體創作者整理思路、產出真實有共鳴的內容。
 
@@ -37,6 +37,25 @@ QUESTION_PROMPT_TEMPLATE = """你是一個專業的寫作教練，擅長幫助
 ["問題1", "問題2", "問題3"]"""
 
 
+# 合成貼文的固定指示放在 system（並標記 prompt cache），每次只變動的話題與問答放在 user message 尾端
+SYNTHESIZE_PROMPT = """你是一個專業的社群媒體內容創作者，擅長用真實、有溫度的文字打動讀者。
+
+請根據用戶提供的問答，幫用戶整理成一篇完整的社群媒體長文貼文。要求：
+- 字數約 300-500 字（繁體中文）
+- 語氣真實、自然，像在跟朋友分享
+- 有開頭吸引人的一句話
+- 內容有深度，分享真實感受和具體細節
+- 結尾有行動呼召或問題引發互動
+- 不要加 hashtag，不要標題
+
+只回傳貼文內容本身，不要其他說明。"""
+
+# 注意：可快取前綴下限為 1024 tokens（claude-sonnet-4-6），此 prompt 約 200 tokens，cache_control 標記暫不生效
+_SYNTHESIZE_SYSTEM = [
+    {"type": "text", "text": SYNTHESIZE_PROMPT, "cache_control": {"type": "ephemeral"}},
+]
+
+
 def _check_session_owner(session: ChatSession, current_user: dict) -> None:
     if session.user_id and session.user_id != current_user["uuid"]:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -195,25 +214,14 @@ async def _do_synthesize(session_id: str):
             for i, q in enumerate(session.questions)
         )
 
-        prompt = f"""你是一個專業的社群媒體內容創作者，擅長用真實、有溫度的文字打動讀者。
-
-用戶想寫一篇關於「{session.topic}」的社群貼文，以下是 AI 引導的問答內容：
-
-{qa_text}
+        prompt = f"""用戶想寫一篇關於「{session.topic}」的社群貼文，以下是 AI 引導的問答內容：
 
-請根據上方的問答，幫用戶整理成一篇完整的社群媒體長文貼文。要求：
-- 字數約 300-500 字（繁體中文）
-- 語氣真實、自然，像在跟朋友分享
-- 有開頭吸引人的一句話
-- 內容有深度，分享真實感受和具體細節
-- 結尾有行動呼召或問題引發互動
-- 不要加 hashtag，不要標題
-
-只回傳貼文內容本身，不要其他說明。"""
+{qa_text}"""
 
         response = await client_anthropic.messages.create(
             model="claude-sonnet-4-6",
             max_tokens=2048,
+            system=_SYNTHESIZE_SYSTEM,
             messages=[{"role": "user", "content": prompt}],
         )
 
@@ -286,7 +294,7 @@ async def publish_draft(
     current_user: dict = Depends(get_current_user),
 ):
     import uuid
-    from app.services.schedule_storage import load_schedule, save_schedule
+    from app.services.schedule_storage import append_post
 
     try:
         session = load_session(session_id)
@@ -316,9 +324,7 @@ async def publish_draft(
         "content_type": "chat_post",
     }
 
-    posts = load_schedule(session.persona_id)
-    posts.append(new_post)
-    save_schedule(session.persona_id, posts)
+    await asyncio.to_thread(append_post, session.persona_id, new_post)
 
     session.status = "published"
     update_session(session)
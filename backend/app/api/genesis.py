@@ -1,6 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from typing import List, Optional
 from pydantic import BaseModel
+import asyncio
 import logging
 from app.models.persona import PersonaCreate, PersonaCard, PersonaResponse
 from app.services import genesis_service
@@ -137,7 +138,7 @@ async def create_persona(
 async def get_persona(persona_id: str):
     """讀取已存儲的人設"""
     from app.services.persona_storage import load_persona
-    persona = load_persona(persona_id)
+    persona = await asyncio.to_thread(load_persona, persona_id)
     if not persona:
         raise HTTPException(status_code=404, detail=f"Persona {persona_id} not found")
     return {"persona_id": persona_id, "persona": persona}
@@ -162,12 +163,12 @@ class PersonaUpdateRequest(BaseModel):
 @router.patch("/persona/{persona_id}")
 async def update_persona(persona_id: str, req: PersonaUpdateRequest):
     """更新人設欄位（部分更新）"""
-    from app.services.persona_storage import load_persona, save_persona
-    persona = load_persona(persona_id)
-    if not persona:
+    from app.services.persona_storage import update_persona_fields
+    updated = await asyncio.to_thread(
+        update_persona_fields, persona_id, req.model_dump(exclude_none=True)
+    )
+    if not updated:
         raise HTTPException(status_code=404, detail="Persona not found")
-    updated = persona.model_copy(update=req.model_dump(exclude_none=True))
-    save_persona(persona_id, updated)
     return {"persona_id": persona_id, "persona": updated}
 
 
@@ -179,10 +180,10 @@ class ChatStyleUpdate(BaseModel):
 @router.patch("/persona/{persona_id}/chat-style")
 async def update_chat_style(persona_id: str, body: ChatStyleUpdate):
     """T4：更新 Persona 的聊天發文風格設定（prompt + 參考圖 URL）"""
-    from app.services.persona_storage import load_persona, save_persona
-    persona = load_persona(persona_id)
-    if not persona:
+    from app.services.persona_storage import update_persona_fields
+    updated = await asyncio.to_thread(
+        update_persona_fields, persona_id, body.model_dump(exclude_none=True)
+    )
+    if not updated:
         raise HTTPException(status_code=404, detail="Persona not found")
-    updated = persona.model_copy(update=body.model_dump(exclude_none=True))
-    save_persona(persona_id, updated)
     return {"persona_id": persona_id, "persona": updated}
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from pydantic import BaseModel
 from typing import Optional
 import anthropic
+import asyncio
 import logging
 from app.services import life_stream_service, users_storage
 from app.api.auth import get_current_user
@@ -127,7 +128,7 @@ async def generate_post(
             )
     # 驗證每日上限（3 篇）
     from app.services.schedule_storage import load_schedule
-    existing = load_schedule(persona_id)
+    existing = await asyncio.to_thread(load_schedule, persona_id)
     day_count = sum(1 for p in existing if p.get("date") == date)
     if day_count >= 3:
         raise HTTPException(status_code=422, detail=f"{date} 已達每日上限（3 篇）")
@@ -161,7 +162,7 @@ async def get_schedule(persona_id: str):
     """
     _verify_persona(persona_id)
     from app.services.schedule_storage import load_schedule
-    posts = load_schedule(persona_id)
+    posts = await asyncio.to_thread(load_schedule, persona_id)
     return {"persona_id": persona_id, "posts": posts}
 
 
@@ -187,7 +188,7 @@ class UpdatePostScheduledAtRequest(BaseModel):
 async def update_post_status(persona_id: str, post_id: str, req: UpdatePostStatusRequest):
     """更新單篇貼文狀態"""
     from app.services.schedule_storage import update_post_status
-    ok = update_post_status(persona_id, post_id, req.status)
+    ok = await asyncio.to_thread(update_post_status, persona_id, post_id, req.status)
     if not ok:
         raise HTTPException(status_code=404, detail=f"Post post_id={post_id} not found for persona {persona_id}")
     return {"ok": True, "post_id": post_id, "status": req.status}
@@ -198,7 +199,7 @@ async def update_post_content(persona_id: str, post_id: str, req: UpdatePostCont
     """更新單篇貼文的文案與重繪方向（scene_prompt）"""
     _verify_persona(persona_id)
     from app.services.schedule_storage import update_post_content
-    ok = update_post_content(persona_id, post_id, req.caption, req.scene_prompt)
+    ok = await asyncio.to_thread(update_post_content, persona_id, post_id, req.caption, req.scene_prompt)
     if not ok:
         raise HTTPException(status_code=404, detail=f"Post post_id={post_id} not found for persona {persona_id}")
     return {"ok": True, "post_id": post_id}
@@ -208,7 +209,7 @@ async def update_post_content(persona_id: str, post_id: str, req: UpdatePostCont
 async def update_post_scheduled_at(persona_id: str, post_id: str, req: UpdatePostScheduledAtRequest):
     """手動覆寫排程時間（一般由 schedule_post 自動處理）"""
     from app.services.schedule_storage import update_post_scheduled_at
-    ok = update_post_scheduled_at(persona_id, post_id, req.scheduled_at)
+    ok = await asyncio.to_thread(update_post_scheduled_at, persona_id, post_id, req.scheduled_at)
     if not ok:
         raise HTTPException(status_code=404, detail=f"Post post_id={post_id} not found for persona {persona_id}")
     return {"ok": True, "post_id": post_id, "scheduled_at": req.scheduled_at}
@@ -219,7 +220,7 @@ async def update_post_image(persona_id: str, post_id: str, req: UpdatePostImageR
     """套用重繪結果：持久化新的 image_url 與 image_prompt"""
     _verify_persona(persona_id)
     from app.services.schedule_storage import update_post_image
-    ok = update_post_image(persona_id, post_id, req.image_url, req.image_prompt)
+    ok = await asyncio.to_thread(update_post_image, persona_id, post_id, req.image_url, req.image_prompt)
     if not ok:
         raise HTTPException(status_code=404, detail=f"Post post_id={post_id} not found for persona {persona_id}")
     return {"ok": True, "post_id": post_id}
@@ -0,0 +1,26 @@
+"""
+Anthropic Client
+----------------
+全後端共用一個 AsyncAnthropic client：genesis / life_stream / chat sessions 都打同一個 API host，
+共用連線池可重用 TLS 連線，HTTP/2 讓併發請求多工於同一條連線，較大的 keepalive 池避免突發流量重新握手。
+"""
+import functools
+import os
+
+import anthropic
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@functools.cache
+def get_client() -> anthropic.AsyncAnthropic:
+    """回傳共用的 AsyncAnthropic client（首次呼叫時建立）"""
+    return anthropic.AsyncAnthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        ),
+    )
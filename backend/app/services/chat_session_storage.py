@@ -1,8 +1,8 @@
-import json
 import re
 import os
 from pathlib import Path
 from app.models.chat_session import ChatSession
+from app.services import json_codec
 
 DATA_DIR = Path("data/chat_sessions")
 
@@ -23,8 +23,7 @@ def _validate_session_id(session_id: str) -> None:
 def save_session(session: ChatSession) -> None:
     _ensure_dir()
     path = DATA_DIR / f"{session.id}.json"
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(session.model_dump(), f, ensure_ascii=False, indent=2)
+    json_codec.dump_file(path, session.model_dump(), indent=True)
 
 
 def load_session(session_id: str) -> ChatSession:
@@ -32,8 +31,7 @@ def load_session(session_id: str) -> ChatSession:
     path = DATA_DIR / f"{session_id}.json"
     if not path.exists():
         raise FileNotFoundError(f"ChatSession {session_id} not found")
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = json_codec.loads(path.read_bytes())
     return ChatSession(**data)
 
 
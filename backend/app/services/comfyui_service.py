@@ -13,7 +13,10 @@ import os
 import httpx
 import asyncio
 import logging
+import random
+import time
 from typing import Optional
+from app.services import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,19 @@ REPLICATE_BASE = "https://api.replicate.com/v1"
 # flux-kontext-max 用 deployment endpoint（不需要 version hash）
 KONTEXT_MAX_URL = f"{REPLICATE_BASE}/models/black-forest-labs/flux-kontext-max/predictions"
 
+# 共用連線池：建立 prediction + 輪詢都打同一個 host，重用 TLS 連線省去每次握手；
+# HTTP/2 讓並發的生成 / 輪詢請求在同一條連線上多工
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=180.0,
+    # 認證等固定 header 於模組載入時建立一次，各請求只帶自己特有的 header
+    headers={
+        "Authorization": f"Bearer {REPLICATE_API_TOKEN}",
+        "Content-Type": "application/json",
+    },
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+)
+
 # V7 LDR 真實感模組（2026-02-21 整合）
 BASE_IMPERFECTIONS = (
     "compressed jpeg artifacts, low bitrate compression, "
@@ -78,12 +94,48 @@ def build_realism_prompt(character_desc: str, scene_prompt: str, camera_style: s
     )
 
 
-async def _poll_prediction(client: httpx.AsyncClient, url: str, headers: dict, timeout: int = 180) -> Optional[str]:
+# Replicate 全域節流：同時進行的 prediction 數上限 + 建立 prediction 的最小間隔
+# （低額度帳號約每 10 秒 1 個 prediction；額度較高時可調低間隔、調高並發）
+REPLICATE_MAX_CONCURRENCY = int(os.getenv("REPLICATE_MAX_CONCURRENCY", "3"))
+REPLICATE_MIN_INTERVAL = float(os.getenv("REPLICATE_MIN_INTERVAL", "10"))
+
+
+class _MinIntervalLimiter:
+    """保證相鄰兩次放行至少間隔 interval 秒；每個呼叫者預約下一個時段，不需要 lock"""
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+_replicate_sem = asyncio.Semaphore(REPLICATE_MAX_CONCURRENCY)
+_replicate_rate = _MinIntervalLimiter(REPLICATE_MIN_INTERVAL)
+
+# 輪詢間隔：由短到長指數退避，快的 prediction 不必每次都等滿固定 3 秒
+POLL_DELAYS = (0.5, 1.0, 2.0, 4.0)
+POLL_MAX_DELAY = 5.0
+POLL_JITTER = 0.2
+
+
+async def _poll_prediction(url: str, timeout: int = 180) -> Optional[str]:
     """Poll Replicate prediction until complete."""
-    for _ in range(timeout // 3):
-        await asyncio.sleep(3)
-        r = await client.get(url, headers=headers)
-        d = r.json()
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while time.monotonic() < deadline:
+        delay = POLL_DELAYS[attempt] if attempt < len(POLL_DELAYS) else POLL_MAX_DELAY
+        # 加一點 jitter，避免同批並發的 prediction 在同一瞬間一起輪詢
+        delay += random.uniform(0, POLL_JITTER)
+        attempt += 1
+        await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        r = await _http.get(url)
+        d = json_codec.loads(r.content)
         status = d.get("status")
         if status == "succeeded":
             output = d.get("output", [])
@@ -120,11 +172,6 @@ async def generate_image_kontext(
 
     logger.info(f"Using flux-kontext-max for face consistency (seed={seed})")
 
-    headers = {
-        "Authorization": f"Bearer {REPLICATE_API_TOKEN}",
-        "Content-Type": "application/json",
-        "Prefer": "wait",
-    }
     payload = {
         "input": {
             "prompt": prompt,
@@ -137,21 +184,20 @@ async def generate_image_kontext(
     }
 
     for attempt in range(4):
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            r = await client.post(KONTEXT_MAX_URL, json=payload, headers=headers)
-            if r.status_code == 429:
-                wait = (attempt + 1) * 15
-                logger.warning(f"Rate limited (kontext-max), retrying in {wait}s (attempt {attempt+1})")
-                await asyncio.sleep(wait)
-                continue
-            r.raise_for_status()
-            d = r.json()
-            status = d.get("status")
-            if status == "succeeded" or d.get("output"):
-                out = d.get("output", [])
-                return out[0] if isinstance(out, list) and out else out
-            poll_url = d.get("urls", {}).get("get", "")
-            return await _poll_prediction(client, poll_url, headers) or ""
+        r = await _http.post(KONTEXT_MAX_URL, json=payload, headers={"Prefer": "wait"}, timeout=300.0)
+        if r.status_code == 429:
+            wait = (attempt + 1) * 15
+            logger.warning(f"Rate limited (kontext-max), retrying in {wait}s (attempt {attempt+1})")
+            await asyncio.sleep(wait)
+            continue
+        r.raise_for_status()
+        d = json_codec.loads(r.content)
+        status = d.get("status")
+        if status == "succeeded" or d.get("output"):
+            out = d.get("output", [])
+            return out[0] if isinstance(out, list) and out else out
+        poll_url = d.get("urls", {}).get("get", "")
+        return await _poll_prediction(poll_url) or ""
 
     logger.error("All retries exhausted for flux-kontext-max image generation")
     return ""
@@ -168,10 +214,6 @@ async def generate_image_realism(
     if not REPLICATE_API_TOKEN:
         return ""
 
-    headers = {
-        "Authorization": f"Bearer {REPLICATE_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
     payload = {
         "version": "39b3434f194f87a900d1bc2b6d4b983e90f0dde1d5022c27b52c143d670758fa",
         "input": {
@@ -187,20 +229,19 @@ async def generate_image_realism(
     }
 
     for attempt in range(4):
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            r = await client.post(f"{REPLICATE_BASE}/predictions", json=payload, headers=headers)
-            if r.status_code == 429:
-                wait = (attempt + 1) * 10
-                logger.warning(f"Rate limited (flux-dev-realism), retrying in {wait}s (attempt {attempt+1})")
-                await asyncio.sleep(wait)
-                continue
-            r.raise_for_status()
-            d = r.json()
-            if d.get("output"):
-                out = d["output"]
-                return out[0] if isinstance(out, list) else out
-            poll_url = d.get("urls", {}).get("get", "")
-            return await _poll_prediction(client, poll_url, headers) or ""
+        r = await _http.post(f"{REPLICATE_BASE}/predictions", json=payload)
+        if r.status_code == 429:
+            wait = (attempt + 1) * 10
+            logger.warning(f"Rate limited (flux-dev-realism), retrying in {wait}s (attempt {attempt+1})")
+            await asyncio.sleep(wait)
+            continue
+        r.raise_for_status()
+        d = json_codec.loads(r.content)
+        if d.get("output"):
+            out = d["output"]
+            return out[0] if isinstance(out, list) else out
+        poll_url = d.get("urls", {}).get("get", "")
+        return await _poll_prediction(poll_url) or ""
 
     logger.error("All retries exhausted for flux-dev-realism image generation")
     return ""
@@ -213,7 +254,7 @@ async def generate_image(
     camera_style: str = "lifestyle",
 ) -> str:
     """
-    主入口：自動選擇生成模式
+    主入口：自動選擇生成模式（經過全域並發 / 速率節流）
     - 有 face_image_url → flux-kontext-max（保持人臉 + 真實感）
     - 無             → flux-dev-realism（最佳真人感）
     """
@@ -221,12 +262,14 @@ async def generate_image(
         logger.warning("REPLICATE_API_TOKEN not set, returning placeholder")
         return "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
 
-    if face_image_url:
-        logger.info(f"Using flux-kontext-max for face consistency (seed={seed})")
-        return await generate_image_kontext(face_image_url, prompt, seed)
-    else:
-        logger.info(f"Using flux-dev-realism (seed={seed})")
-        return await generate_image_realism(prompt, seed)
+    async with _replicate_sem:
+        await _replicate_rate.wait()
+        if face_image_url:
+            logger.info(f"Using flux-kontext-max for face consistency (seed={seed})")
+            return await generate_image_kontext(face_image_url, prompt, seed)
+        else:
+            logger.info(f"Using flux-dev-realism (seed={seed})")
+            return await generate_image_realism(prompt, seed)
 
 
 async def generate_images_batch(
@@ -234,11 +277,10 @@ async def generate_images_batch(
     seeds: list,
     face_image_url: str = "",
 ) -> list:
-    """批次並發生成（最多 3 個並發）"""
-    sem = asyncio.Semaphore(3)
-
-    async def bounded(p, s):
-        async with sem:
-            return await generate_image(p, s, face_image_url)
-
-    return await asyncio.gather(*[bounded(p, s) for p, s in zip(prompts, seeds)])
+    """批次並發生成（並發數由 generate_image 內的 _replicate_sem 限制）；任一張失敗時取消其餘仍在進行的生成，並拋出原始例外"""
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(generate_image(p, s, face_image_url)) for p, s in zip(prompts, seeds)]
+    except BaseExceptionGroup as eg:
+        raise eg.exceptions[0]
+    return [t.result() for t in tasks]
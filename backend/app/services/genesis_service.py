@@ -1,50 +1,122 @@
-import json
+import asyncio
+import logging
 import os
+import random
+import re
 import anthropic
+from datetime import datetime
 from dotenv import load_dotenv
-from app.models.persona import AppearanceFeatures, PersonaCard, PersonaResponse
+from app.models.persona import AppearanceFeatures, ExamplePost, PersonaCard, PersonaResponse
+from app.services import anthropic_client, cloudinary_service, comfyui_service, json_codec
+from app.services.life_stream_service import (
+    SCENE_PROMPT_FIELD,
+    SCENE_PROMPT_QUALITY_GUIDE,
+    _extract_json_from_claude,
+    _infer_camera_style,
+)
+from app.services.persona_storage import save_persona
 import uuid
 import base64
-from typing import Optional
+from typing import BinaryIO, Optional
 from PIL import Image
 import io
 
 load_dotenv()
 
-client_anthropic = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+logger = logging.getLogger(__name__)
 
+client_anthropic = anthropic_client.get_client()
 
-def compress_image(image_bytes: bytes, max_size: int = 1024, quality: int = 80) -> tuple[bytes, str]:
+CLAUDE_MAX_RETRIES = 4
+
+# 從 Claude 回應中擷取第一個 JSON 物件
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Vision 圖片預算：長邊超過 ~768px 對辨識幫助有限，卻會增加 vision tile 與 input tokens
+VISION_MAX_SIZE = int(os.getenv("VISION_MAX_SIZE", "768"))
+VISION_JPEG_Q = int(os.getenv("VISION_JPEG_Q", "70"))
+
+
+def compress_image(fp: BinaryIO, max_size: int = VISION_MAX_SIZE, quality: int = VISION_JPEG_Q) -> tuple[bytes, str]:
     """
     压缩图片以减少 token 消耗
     
     Args:
-        image_bytes: 原始图片字节
+        fp: 原始图片的二进制文件对象（如 UploadFile.file），PIL 直接按需读取，不先整份读入内存
         max_size: 最大边长（像素）
         quality: JPEG 质量（1-100）
     
     Returns:
         (压缩后的字节, MIME type)
     """
-    img = Image.open(io.BytesIO(image_bytes))
-    
-    # 转换 RGBA 到 RGB（处理 PNG）
-    if img.mode == 'RGBA':
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        background.paste(img, mask=img.split()[3])  # Alpha channel
-        img = background
-    elif img.mode != 'RGB':
-        img = img.convert('RGB')
-    
-    # 按比例缩放
-    if max(img.size) > max_size:
-        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-    
-    # 压缩为 JPEG
-    buffer = io.BytesIO()
-    img.save(buffer, format='JPEG', quality=quality, optimize=True)
-    
-    return buffer.getvalue(), 'image/jpeg'
+    img = Image.open(fp)
+    try:
+        # JPEG 解码时直接以 1/2、1/4、1/8 缩放（DCT 降采样），不必先解出全尺寸
+        img.draft('RGB', (max_size, max_size))
+
+        # 转换 RGBA 到 RGB（处理 PNG）；原图转换后立即 close，释放 C 层像素缓冲
+        if img.mode == 'RGBA':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])  # Alpha channel
+            img.close()
+            img = background
+        elif img.mode != 'RGB':
+            converted = img.convert('RGB')
+            img.close()
+            img = converted
+
+        # 按比例缩放：先用 reduce()（box filter）整数倍缩到约 2×max_size，再 BILINEAR 到目标尺寸
+        # Claude Vision 会再切成粗粒度 patch，LANCZOS 的细节差异看不出来
+        if max(img.size) > max_size:
+            img.thumbnail((max_size, max_size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+        # 压缩为 JPEG（一次性 API payload，不做 optimize 的第二轮 Huffman 编码）
+        with io.BytesIO() as buffer:
+            img.save(buffer, format='JPEG', quality=quality, optimize=False)
+            return buffer.getvalue(), 'image/jpeg'
+    finally:
+        img.close()
+
+
+async def _encode_one(img) -> tuple[str, str]:
+    """於 worker thread 壓縮單張上傳圖片並 base64 編碼，回傳 (MIME type, base64 字串)"""
+    # 直接把 SpooledTemporaryFile 交給 PIL，不先 read() 成整份 bytes
+    await img.seek(0)
+    # 压缩图片减少 token 消耗（预设最大 768px，质量 70%，可由环境变量调整）
+    compressed, mime_type = await asyncio.to_thread(compress_image, img.file)
+    b64 = await asyncio.to_thread(base64.b64encode, compressed)
+    return mime_type, b64.decode()
+
+
+def _retry_wait_seconds(err: anthropic.RateLimitError, attempt: int) -> float:
+    """依 Anthropic 回傳的 retry-after 決定等待秒數（無 header 時 5/10/15 秒），加 jitter 並上限 60 秒"""
+    fallback = (attempt + 1) * 5
+    response = getattr(err, "response", None)
+    try:
+        wait = float(response.headers.get("retry-after", fallback)) if response is not None else fallback
+    except ValueError:
+        wait = fallback
+    # jitter：避免多個併發請求在同一時間點一起重試
+    return min(60.0, wait + random.uniform(0, 2))
+
+
+async def _with_claude_retry(coro_fn):
+    """呼叫 Claude API，遇到 rate limit 時依 retry-after 等待後重試
+
+    Args:
+        coro_fn: 無參數、回傳 coroutine 的 callable（每次重試都需要新的 coroutine）
+    """
+    for attempt in range(CLAUDE_MAX_RETRIES):
+        try:
+            return await coro_fn()
+        except anthropic.RateLimitError as e:
+            if attempt == CLAUDE_MAX_RETRIES - 1:
+                logger.error(f"❌ Claude API rate limit exceeded after {CLAUDE_MAX_RETRIES} retries")
+                raise  # 最后一次仍失败则抛出异常
+            wait_time = _retry_wait_seconds(e, attempt)
+            logger.warning(f"⏳ Claude API rate limit, waiting {wait_time:.1f}s (attempt {attempt+1}/{CLAUDE_MAX_RETRIES})...")
+            await asyncio.sleep(wait_time)
+
 
 PERSONA_PROMPT = """你是一個專業的虛擬人設設計師。
 根據用戶的一句話描述，生成一個完整的 AI 網紅人設。
@@ -75,6 +147,9 @@ APPEARANCE_PROMPT = """你是一個專業的角色視覺分析師，專門為 AI
 1. image_prompt 必須極度詳細，讓 AI 生圖模型能在不同場景中生成同一個人
 2. hair 欄位使用範圍描述（如 \"long dark hair\"），避免過於具體（如 \"shoulder-length layered black hair\"），保留後續調整彈性"""
 
+_APPEARANCE_USER_TEXT = APPEARANCE_PROMPT + "\n\n請分析這些圖片中人物的外觀特徵，輸出 JSON 格式。"
+
+
 async def create_persona(description: str, persona_id: Optional[str] = None, content_types: Optional[list] = None) -> dict:
     """T3: 一句話 → 人設 JSON
 
@@ -83,19 +158,17 @@ async def create_persona(description: str, persona_id: Optional[str] = None, con
         persona_id: 指定的 persona ID（若無則自動生成 UUID）
         content_types: 預設內容類型列表（1-3 個）
     """
-    from datetime import datetime
-
-    message = await client_anthropic.messages.create(
+    message = await _with_claude_retry(lambda: client_anthropic.messages.create(
         model="claude-3-haiku-20240307",
         max_tokens=1024,
         messages=[
             {"role": "user", "content": f"請根據以下描述生成人設：{description}"}
         ],
         system=PERSONA_PROMPT
-    )
+    ))
 
     raw = message.content[0].text
-    persona_data = json.loads(raw)
+    persona_data = json_codec.loads(raw)
     pid = persona_id or str(uuid.uuid4())
 
     persona_card = PersonaCard(
@@ -110,6 +183,7 @@ async def create_persona(description: str, persona_id: Optional[str] = None, con
         "persona": persona_card
     }
 
+
 async def analyze_appearance(images, image_urls: Optional[list] = None) -> dict:
     """T2: 圖片 → 外觀描述（Claude Vision）
     
@@ -123,63 +197,34 @@ async def analyze_appearance(images, image_urls: Optional[list] = None) -> dict:
             "reference_face_url": str  # 第一張圖片的 URL（用於 InstantID）
         }
     """
-    image_contents = []
-    for img in images:
-        content = await img.read()
-        # 压缩图片减少 token 消耗（最大 1024px，质量 80%）
-        compressed, mime_type = compress_image(content, max_size=1024, quality=80)
-        b64 = base64.b64encode(compressed).decode()
-        image_contents.append({
-            "type": "image_url",
-            "image_url": {"url": f"data:{mime_type};base64,{b64}"}
-        })
-    
-    # 用 Claude Vision 替代 GPT-4o（同樣支援圖片輸入）
-    claude_content = []
-    for img_item in image_contents:
-        if img_item["type"] == "image_url":
-            url = img_item["image_url"]["url"]
-            # data:image/jpeg;base64,xxxx → media_type + data
-            header, data = url.split(",", 1)
-            media_type = header.split(":")[1].split(";")[0]
-            claude_content.append({
-                "type": "image",
-                "source": {"type": "base64", "media_type": media_type, "data": data}
-            })
+    # 多張圖片並行壓縮（PIL 工作移到 thread，不阻塞 event loop）
+    results = await asyncio.gather(*(_encode_one(img) for img in images))
+    # 直接組成 Claude Vision 的 image block，不經 data URL 再拆解
+    claude_content = [
+        {"type": "image", "source": {"type": "base64", "media_type": mime_type, "data": b64}}
+        for mime_type, b64 in results
+    ]
     claude_content.append({
         "type": "text",
-        "text": APPEARANCE_PROMPT + "\n\n請分析這些圖片中人物的外觀特徵，輸出 JSON 格式。"
+        "text": _APPEARANCE_USER_TEXT
     })
 
-    # 重试机制：处理 rate limit（增加等待时间）
-    import asyncio
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    max_retries = 4  # 增加到 4 次
-    for attempt in range(max_retries):
-        try:
-            response = await client_anthropic.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": claude_content}]
-            )
-            break  # 成功则跳出
-        except anthropic.RateLimitError as e:
-            if attempt < max_retries - 1:
-                # 增加等待时间：20/40/60 秒
-                wait_time = (attempt + 1) * 20
-                logger.warning(f"⏳ Claude API rate limit, waiting {wait_time}s (attempt {attempt+1}/{max_retries})...")
-                await asyncio.sleep(wait_time)
-            else:
-                logger.error(f"❌ Claude API rate limit exceeded after {max_retries} retries")
-                raise  # 最后一次仍失败则抛出异常
+    # 統計 payload 大小要走訪所有 block，log level 高於 INFO 時直接略過
+    if logger.isEnabledFor(logging.INFO):
+        b64_bytes = sum(len(block["source"]["data"]) for block in claude_content if block["type"] == "image")
+        logger.info(f"Vision payload: {len(images)} image(s), {b64_bytes / 1024:.0f} KB base64")
+
+    # 重试机制：处理 rate limit（依 retry-after 等待）
+    response = await _with_claude_retry(lambda: client_anthropic.messages.create(
+        model="claude-3-haiku-20240307",
+        max_tokens=1024,
+        messages=[{"role": "user", "content": claude_content}]
+    ))
 
     raw = response.content[0].text
     # 從回應中取出 JSON
-    import re
-    match = re.search(r'\{.*\}', raw, re.DOTALL)
-    appearance_data = json.loads(match.group() if match else raw)
+    match = _JSON_RE.search(raw)
+    appearance_data = json_codec.loads(match.group() if match else raw)
     
     # 保存第一張圖片的 URL 作為 reference_face_url
     reference_face_url = image_urls[0] if image_urls and len(image_urls) > 0 else ""
@@ -198,10 +243,6 @@ async def generate_example_post(persona: PersonaCard) -> dict:
     Returns:
         包含 scene, caption, scene_prompt, hashtags, image_url 的 dict
     """
-    from datetime import datetime
-    import logging
-    logger = logging.getLogger(__name__)
-    
     # 使用第一個 content_type，若無則使用 "personal_story"
     content_type = None
     if persona.content_types and len(persona.content_types) > 0:
@@ -216,8 +257,6 @@ async def generate_example_post(persona: PersonaCard) -> dict:
     }.get(content_type, "日常分享")
     
     # 構建 prompt（類似 SINGLE_POST_PROMPT）
-    from app.services.life_stream_service import SCENE_PROMPT_FIELD, SCENE_PROMPT_QUALITY_GUIDE
-    
     persona_dict = persona.model_dump(exclude={"reference_face_url", "created_at", "id", "example_post"})
     
     example_post_prompt = f"""你是一個 AI 網紅內容規劃師。
@@ -242,13 +281,14 @@ async def generate_example_post(persona: PersonaCard) -> dict:
             max_tokens=512,
             messages=[{
                 "role": "user",
-                "content": f"請為以下人設規劃 1 篇 Instagram 範例內容（內容類型：{content_type_label}）：\n{json.dumps(persona_dict, ensure_ascii=False)}"
+                "content": f"請為以下人設規劃 1 篇 Instagram 範例內容（內容類型：{content_type_label}）：\n{json_codec.dumps(persona_dict).decode()}"
             }],
             system=example_post_prompt,
         )
         
+        if message.stop_reason == "max_tokens":
+            raise ValueError("Claude 回應被截斷，範例貼文內容不完整")
         # 解析 JSON
-        from app.services.life_stream_service import _extract_json_from_claude
         post_data = _extract_json_from_claude(message.content[0].text, start_char="{")
         
     except Exception as e:
@@ -270,10 +310,6 @@ async def generate_example_post(persona: PersonaCard) -> dict:
     
     if persona.reference_face_url and persona.appearance:
         try:
-            from app.services import comfyui_service
-            from app.services.cloudinary_service import upload_from_url
-            from app.services.life_stream_service import _infer_camera_style
-            
             scene_prompt = post_data.get("scene_prompt", "lifestyle photo")
             camera_style = _infer_camera_style(scene_prompt)
             
@@ -295,7 +331,7 @@ async def generate_example_post(persona: PersonaCard) -> dict:
             if replicate_url:
                 # 上傳到 Cloudinary
                 try:
-                    image_url = await upload_from_url(replicate_url, folder=f"virtual_prism/{persona.id}/example")
+                    image_url = await cloudinary_service.upload_from_url(replicate_url, folder=f"virtual_prism/{persona.id}/example")
                 except Exception as cdn_err:
                     logger.warning(f"Cloudinary upload failed for example post, using Replicate URL: {cdn_err}")
                     image_url = replicate_url
@@ -319,10 +355,6 @@ async def confirm_persona(persona: PersonaCard, reference_face_url: Optional[str
         persona: PersonaCard 物件
         reference_face_url: 人臉參考圖 URL（用於 InstantID）
     """
-    from datetime import datetime
-    import logging
-    logger = logging.getLogger(__name__)
-    
     persona_id = persona.id or str(uuid.uuid4())
     
     # 確保 persona 包含所有必要欄位
@@ -336,16 +368,14 @@ async def confirm_persona(persona: PersonaCard, reference_face_url: Optional[str
         try:
             logger.info(f"Generating example post for persona {persona_id}...")
             example_data = await generate_example_post(persona)
-            
-            from app.models.persona import ExamplePost
+
             persona.example_post = ExamplePost(**example_data)
             logger.info(f"Example post generated successfully for persona {persona_id}")
         except Exception as e:
             logger.error(f"Failed to generate example post for persona {persona_id}: {e}")
             # 範例產出失敗不影響 persona 建立，繼續執行
     
-    # 儲存 persona 到檔案系統
-    from app.services.persona_storage import save_persona
-    save_persona(persona_id, persona)
+    # 儲存 persona 到檔案系統（丟到 thread 執行，避免序列化與寫檔阻塞 event loop）
+    await asyncio.to_thread(save_persona, persona_id, persona)
     
     return {"persona_id": persona_id, "status": "locked", "persona": persona}
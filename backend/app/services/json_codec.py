@@ -0,0 +1,63 @@
+"""
+JSON Codec
+----------
+優先使用 orjson（C 實作，解析 / 序列化快數倍），未安裝時 fallback 到標準庫 json，
+讓沒有 orjson wheel 的平台（如部分 Windows 環境）仍可執行。
+
+dumps 一律回傳 UTF-8 bytes，中文不轉義（等同 json.dumps(..., ensure_ascii=False)）。
+dump_file 先寫同目錄的暫存檔再 os.replace，寫到一半 crash 也不會留下損毀的 JSON；
+暫存檔名每次唯一，多個 thread 同時寫同一檔案時不會互相覆蓋暫存檔。
+mkstemp 建立的暫存檔權限為 0600，replace 前改回原檔權限（新檔則依 umask），避免資料檔權限被悄悄收緊。
+"""
+import contextlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError 為 json.JSONDecodeError 的子類別，兩種實作都可用這個 catch
+JSONDecodeError = json.JSONDecodeError
+
+# 讀取 umask 只能先設再還原，不是 thread-safe，因此只在 import 時讀一次
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """解析 JSON 字串或 bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """序列化為 UTF-8 bytes；indent=True 時以 2 空格縮排（方便人工查看資料檔）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dump_file(path: Path, obj: Any, indent: bool = False) -> None:
+    """原子寫入 JSON 檔：寫入同目錄的唯一暫存檔後 os.replace（同一檔案系統上為原子操作）"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dumps(obj, indent=indent))
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
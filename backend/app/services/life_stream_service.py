@@ -1,26 +1,26 @@
-import json
-import os
+import random
 import uuid
 import asyncio
 import logging
-import anthropic
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from typing import Optional
-from app.services import comfyui_service
+from app.services import anthropic_client, comfyui_service, json_codec, llm_cache
 from app.services.persona_storage import load_persona
-from app.services.schedule_storage import save_schedule, load_schedule
+from app.services.schedule_storage import append_post, save_schedule
 from app.services.cloudinary_service import upload_from_url
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+client = anthropic_client.get_client()
 
 
 async def _analyze_reference_image(image_url: str) -> str:
-    """用 Claude Vision 分析參考圖，提取場景、姿勢、動作描述（忽略人臉）。"""
+    """用 Claude Vision 分析參考圖，提取場景、姿勢、動作描述（忽略人臉）。無參考圖時回傳空字串。"""
+    if not image_url:
+        return ""
     try:
         msg = await client.messages.create(
             model="claude-haiku-4-5-20251001",
@@ -47,6 +47,14 @@ async def _analyze_reference_image(image_url: str) -> str:
 # Constants
 # ---------------------------------------------------------------------------
 
+# 排程 / 單篇規劃使用的模型（也是 llm_cache key 的一部分）
+PLAN_MODEL = "claude-3-haiku-20240307"
+
+# 輸出上限：3 天排程實際約 900-1200 tokens（英文 scene_prompt 較長），單篇約 300-400 tokens。
+# 截斷會直接報錯，上限需留足餘裕；生成在 end_turn 就會停止，調低上限並不會更快
+SCHEDULE_MAX_TOKENS = 2048
+SINGLE_POST_MAX_TOKENS = 512
+
 SCENE_CAMERA_MAP = {
     "night": "night", "neon": "night", "bar": "night", "club": "night",
     "portrait": "portrait", "studio": "portrait",
@@ -82,7 +90,7 @@ CONTENT_TYPE_STYLES = {
     "personal_story": "個人故事 — 故事敘事，情感共鳴，真實動人",
 }
 
-def _build_single_post_prompt(content_type: Optional[str] = None) -> str:
+def _render_single_post_prompt(content_type: Optional[str] = None) -> str:
     """根據內容類型建構 prompt"""
     content_type_guide = ""
     if content_type and content_type in CONTENT_TYPE_STYLES:
@@ -103,6 +111,27 @@ def _build_single_post_prompt(content_type: Optional[str] = None) -> str:
 
 {SCENE_PROMPT_QUALITY_GUIDE}"""
 
+
+# 內容類型只有固定幾種：模組載入時就把每種 prompt 組好，請求時直接查表
+_SINGLE_POST_PROMPTS = {
+    content_type: _render_single_post_prompt(content_type)
+    for content_type in (None, *CONTENT_TYPE_STYLES)
+}
+
+
+def _build_single_post_prompt(content_type: Optional[str] = None) -> str:
+    """根據內容類型取得 prompt（未知類型視同未指定）"""
+    return _SINGLE_POST_PROMPTS.get(content_type, _SINGLE_POST_PROMPTS[None])
+
+
+def _single_post_system(prompt: str) -> list:
+    """單篇 prompt 同樣是固定前綴：包成 system block 並標記 prompt cache
+
+    注意：claude-3-haiku 的可快取前綴下限為 2048 tokens，單篇 prompt 約 850 tokens，標記暫不生效。
+    """
+    return [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+
+
 SCHEDULE_PROMPT = f"""你是一個 AI 網紅內容規劃師。
 根據以下人設 JSON，為這個 AI 網紅規劃未來 3 天的 Instagram 圖文內容。
 
@@ -115,13 +144,23 @@ SCHEDULE_PROMPT = f"""你是一個 AI 網紅內容規劃師。
     "scene": "場景描述（中文，25字以內）",
     "caption": "Instagram 文案（中文，含 1-2 個 emoji，80字以內）",
     {SCENE_PROMPT_FIELD},
+    "camera_style": "{'|'.join(comfyui_service.CAMERA_STYLES)}",
+    "seed": <1-999999 的隨機整數，每天不同>,
     "hashtags": ["#tag1", "#tag2", "#tag3"]
   }}
 ]
 
+camera_style 依場景從上列選項擇一。
 確保 3 天場景多樣化（室內/室外、日間/夜間交替），符合人設生活風格。
 {SCENE_PROMPT_QUALITY_GUIDE}"""
 
+# 排程 prompt 是固定前綴：以 system block 送出並標記 prompt cache，人設 JSON 放在 user message。
+# 注意：claude-3-haiku 的可快取前綴下限為 2048 tokens，目前約 910 tokens，標記暫不生效；
+# prompt 變長或換成門檻較低的模型後才會實際命中快取
+_SCHEDULE_SYSTEM = [
+    {"type": "text", "text": SCHEDULE_PROMPT, "cache_control": {"type": "ephemeral"}},
+]
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
@@ -135,23 +174,131 @@ def _infer_camera_style(scene_prompt: str) -> str:
     return "lifestyle"
 
 
+def _resolve_camera_style(item: dict, scene_prompt: str) -> str:
+    """優先使用 Claude 規劃時給的 camera_style；缺少或不合法時回到關鍵字推斷。"""
+    camera_style = item.get("camera_style")
+    if camera_style in comfyui_service.CAMERA_STYLES:
+        return camera_style
+    return _infer_camera_style(scene_prompt)
+
+
+def _resolve_seed(item: dict, used: set, default: int = 42) -> int:
+    """使用 Claude 規劃時給的 seed；缺少或不是整數時用預設值，與前幾天重複時改抽隨機值。
+
+    used 為本次排程已用過的 seed，呼叫後會加入這次的結果。
+    """
+    seed = item.get("seed")
+    if not isinstance(seed, int) or isinstance(seed, bool):
+        seed = default
+    while seed in used:
+        seed = random.randint(1, 999999)
+    used.add(seed)
+    return seed
+
+
+_JSON_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _balanced_json_span(text: str, start: int) -> Optional[str]:
+    """從 start 的 '{' / '[' 開始掃描，回傳第一段括號平衡的 JSON；結尾未閉合（被截斷）時回傳 None。
+
+    字串內的括號與跳脫字元不計入深度。
+    """
+    stack = []
+    in_str = escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in _JSON_CLOSERS:
+            stack.append(_JSON_CLOSERS[ch])
+        elif ch in "}]":
+            stack.pop()
+            if not stack:
+                return text[start:i + 1]
+    return None
+
+
 def _extract_json_from_claude(raw: str, start_char: str) -> any:
-    """從 Claude 回應中提取 JSON，處理 markdown code block 與前綴文字。"""
+    """從 Claude 回應中提取 JSON，處理 markdown code block 與前後說明文字。
+
+    結尾未閉合（多半是 max_tokens 截斷）時直接報錯，不補括號：補出來的內容不完整，不能寫入快取或排程。
+    """
     text = raw.strip()
-    if text.startswith("```"):
-        text = text.split("```")[1]
-        if text.startswith("json"):
-            text = text[4:].strip()
     idx = text.find(start_char)
     if idx == -1:
         raise ValueError(f"Claude 回應中找不到 JSON（找 '{start_char}'）：{text[:200]}")
-    text = text[idx:]
+    span = _balanced_json_span(text, idx)
+    if span is None:
+        raise ValueError(f"Claude 回應 JSON 未閉合（可能被截斷）：{text[-200:]}")
     try:
-        return json.loads(text)
-    except json.JSONDecodeError as e:
+        return json_codec.loads(span)
+    except json_codec.JSONDecodeError as e:
         raise ValueError(f"Claude 回應 JSON 格式錯誤：{e}") from e
 
 
+class _JsonArrayStream:
+    """增量解析 streaming 中的 JSON 陣列：每收到一個完整的頂層物件就解析並回傳，不必等整個回應結束。
+
+    跳過 '[' 之前的前綴文字（markdown code block 等），忽略元素之間的逗號與空白。
+    closed 在讀到陣列結尾的 ']' 後才為 True；串流結束時仍為 False 表示回應被截斷。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.closed = False
+        self._started = False
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._buf: list = []
+
+    def feed(self, chunk: str) -> list:
+        items = []
+        if self.closed:
+            return items
+        for ch in chunk:
+            if not self._started:
+                self._started = ch == "["
+                continue
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buf = [ch]
+                elif ch == "]":
+                    self.closed = True
+                    break
+                continue
+            self._buf.append(ch)
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json_codec.loads("".join(self._buf)))
+                    except json_codec.JSONDecodeError as e:
+                        raise ValueError(f"Claude 回應 JSON 格式錯誤：{e}") from e
+        self.count += len(items)
+        return items
+
+
 async def _generate_and_upload_image(
     full_prompt: str,
     face_image_url: str,
@@ -187,11 +334,14 @@ async def _generate_and_upload_image(
 
 async def generate_weekly_schedule(persona_id: str, appearance_prompt: str = "") -> dict:
     """根據人設生成 3 天圖文排程（含生圖）"""
-    persona_data = load_persona(persona_id)
+    persona_data = await asyncio.to_thread(load_persona, persona_id)
     if not persona_data:
         raise ValueError(f"Persona {persona_id} 不存在。請先完成 Onboarding 創建人設。")
 
-    persona = persona_data.model_dump(exclude={"reference_face_url", "created_at", "id"})
+    # 人設 JSON 只序列化一次：同一字串用於 Claude user message 與 llm_cache key
+    persona_json = json_codec.dumps(
+        persona_data.model_dump(exclude={"reference_face_url", "created_at", "id"})
+    ).decode()
     face_image_url = persona_data.reference_face_url or ""
     base_prompt = (
         appearance_prompt
@@ -199,24 +349,14 @@ async def generate_weekly_schedule(persona_id: str, appearance_prompt: str = "")
         or "attractive person, high quality, realistic"
     )
     start_date = datetime.now()
+    used_seeds: set = set()
 
-    # Step 1: LLM 規劃 3 天內容
-    message = await client.messages.create(
-        model="claude-3-haiku-20240307",
-        max_tokens=2048,
-        messages=[{
-            "role": "user",
-            "content": f"請為以下人設規劃 7 天 Instagram 內容：\n{json.dumps(persona, ensure_ascii=False)}"
-        }],
-        system=SCHEDULE_PROMPT,
-    )
-    schedule = _extract_json_from_claude(message.content[0].text, start_char="[")
-
-    # Step 2: 循序生圖（避免 Replicate 限速）
+    # Step 2: 生圖；由 generate_days worker 與 Step 1 的 streaming 並行執行
     async def generate_day(item: dict, offset: int) -> dict:
         date = (start_date + timedelta(days=offset)).strftime("%Y-%m-%d")
         scene_prompt = item.get("scene_prompt", item.get("image_prompt", "lifestyle photo"))
-        camera_style = _infer_camera_style(scene_prompt)
+        camera_style = _resolve_camera_style(item, scene_prompt)
+        seed = _resolve_seed(item, used_seeds)
         full_prompt = comfyui_service.build_realism_prompt(
             character_desc=base_prompt,
             scene_prompt=scene_prompt,
@@ -227,7 +367,7 @@ async def generate_weekly_schedule(persona_id: str, appearance_prompt: str = "")
             face_image_url=face_image_url,
             persona_id=persona_id,
             camera_style=camera_style,
-            seed=item.get("seed", 42),
+            seed=seed,
         )
         return {
             **item,
@@ -235,21 +375,74 @@ async def generate_weekly_schedule(persona_id: str, appearance_prompt: str = "")
             "image_prompt": full_prompt,
             "date": date,
             "image_url": image_url,
-            "seed": item.get("seed", 42) if image_url else -1,
+            "camera_style": camera_style,
+            "seed": seed if image_url else -1,
             "status": "draft",
             "scheduled_at": None,
             "job_id": None,
         }
 
-    days = []
-    for i, item in enumerate(schedule):
-        if i > 0:
-            logger.info(f"⏳ Waiting 10 seconds before generating day {i+1}/3...")
-            await asyncio.sleep(10)
-        logger.info(f"🎨 Generating image for day {i+1}/3...")
-        days.append(await generate_day(item, i))
-
-    save_schedule(persona_id, days)
+    async def generate_days(queue: asyncio.Queue) -> list:
+        # 每天一個 task 並行生圖；Replicate 的並發與速率上限由 comfyui_service 統一節流
+        tasks = []
+        try:
+            async with asyncio.TaskGroup() as tg:
+                while (item := await queue.get()) is not None:
+                    logger.info(f"🎨 Generating image for day {len(tasks)+1}/3...")
+                    tasks.append(tg.create_task(generate_day(item, len(tasks))))
+        except BaseExceptionGroup as eg:
+            # TaskGroup 會把失敗包成 ExceptionGroup；拋出第一個原始例外，API 層才能照舊依型別處理
+            raise eg.exceptions[0]
+        return [t.result() for t in tasks]
+
+    # Step 1: LLM 規劃 3 天內容（streaming）— 每解析出完整的一天就交給生圖 worker，
+    # 第 1 天的圖在 LLM 還在輸出後面幾天時就開始生成
+    user_content = f"請為以下人設規劃 7 天 Instagram 內容：\n{persona_json}"
+    cache_key = llm_cache.make_key(PLAN_MODEL, SCHEDULE_PROMPT, user_content, start_date.strftime("%Y-%m-%d"))
+    cached = await asyncio.to_thread(llm_cache.get, cache_key)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    worker = asyncio.create_task(generate_days(queue))
+    try:
+        scanner = _JsonArrayStream()
+        if cached is not None:
+            raw_parts = [cached]
+            for item in scanner.feed(cached):
+                queue.put_nowait(item)
+        else:
+            # assistant prefill "["：Claude 直接從陣列內容接著寫，不會輸出前綴說明或 code block
+            raw_parts = ["["]
+            scanner.feed("[")
+            async with client.messages.stream(
+                model=PLAN_MODEL,
+                max_tokens=SCHEDULE_MAX_TOKENS,
+                messages=[
+                    {"role": "user", "content": user_content},
+                    {"role": "assistant", "content": "["},
+                ],
+                system=_SCHEDULE_SYSTEM,
+            ) as stream:
+                async for text in stream.text_stream:
+                    raw_parts.append(text)
+                    for item in scanner.feed(text):
+                        queue.put_nowait(item)
+        if not scanner.closed:
+            if not scanner.count:
+                # 沒有串流出任何一天：交給完整解析，沿用其錯誤訊息（找不到 JSON / 格式錯誤）
+                _extract_json_from_claude("".join(raw_parts), start_char="[")
+            # 陣列沒有收尾（多半是 max_tokens 截斷）：不回傳少了幾天的排程
+            raise ValueError(f"Claude 回應被截斷，排程不完整（只收到 {scanner.count} 天）")
+    except BaseException:
+        worker.cancel()
+        # 等 worker 真正結束並取回其例外（取消或生圖失敗），避免 task 洩漏與 "exception never retrieved"
+        await asyncio.gather(worker, return_exceptions=True)
+        raise
+    queue.put_nowait(None)
+    if cached is None:
+        await asyncio.to_thread(llm_cache.put, cache_key, "".join(raw_parts))
+    days = await worker
+
+    await asyncio.to_thread(save_schedule, persona_id, days)
     logger.info(f"Schedule saved for persona_id={persona_id} ({len(days)} days)")
     return {"persona_id": persona_id, "generated_at": datetime.now().isoformat(), "schedule": days}
 
@@ -272,11 +465,18 @@ async def generate_single_post(
         reference_image_url: 參考圖片 URL（可選）
         content_type: 內容類型（可選，若無則使用 Persona 預設）
     """
-    persona_data = load_persona(persona_id)
+    # 讀 persona（丟到 thread）與分析參考圖場景（僅用於 prompt 增強，不影響人臉）彼此獨立，並行執行
+    persona_data, ref_scene_desc = await asyncio.gather(
+        asyncio.to_thread(load_persona, persona_id),
+        _analyze_reference_image(reference_image_url),
+    )
     if not persona_data:
         raise ValueError(f"Persona {persona_id} 不存在。")
 
-    persona = persona_data.model_dump(exclude={"reference_face_url", "created_at", "id"})
+    # 人設 JSON 只序列化一次：同一字串用於 Claude user message 與 llm_cache key
+    persona_json = json_codec.dumps(
+        persona_data.model_dump(exclude={"reference_face_url", "created_at", "id"})
+    ).decode()
     face_image_url = persona_data.reference_face_url or ""
     base_prompt = (
         appearance_prompt
@@ -289,13 +489,8 @@ async def generate_single_post(
     if not effective_content_type and persona_data.content_types and len(persona_data.content_types) > 0:
         effective_content_type = persona_data.content_types[0]
 
-    # 分析參考圖場景（僅用於 prompt 增強，不影響人臉）
-    ref_scene_desc = ""
-    if reference_image_url:
-        ref_scene_desc = await _analyze_reference_image(reference_image_url)
-
     # Step 1: LLM 規劃 1 篇內容（使用動態 prompt）
-    user_content = f"請為以下人設規劃 1 篇 Instagram 內容（日期：{date}）：\n{json.dumps(persona, ensure_ascii=False)}"
+    user_content = f"請為以下人設規劃 1 篇 Instagram 內容（日期：{date}）：\n{persona_json}"
     if user_hint:
         user_content += f"\n使用者偏好：{user_hint}"
     if ref_scene_desc:
@@ -303,16 +498,28 @@ async def generate_single_post(
     
     single_post_prompt = _build_single_post_prompt(effective_content_type)
     
-    message = await client.messages.create(
-        model="claude-3-haiku-20240307",
-        max_tokens=512,
-        messages=[{
-            "role": "user",
-            "content": user_content,
-        }],
-        system=single_post_prompt,
-    )
-    item = _extract_json_from_claude(message.content[0].text, start_char="{")
+    cache_key = llm_cache.make_key(PLAN_MODEL, single_post_prompt, user_content)
+    cached = await asyncio.to_thread(llm_cache.get, cache_key)
+    if cached is None:
+        message = await client.messages.create(
+            model=PLAN_MODEL,
+            max_tokens=SINGLE_POST_MAX_TOKENS,
+            messages=[
+                {"role": "user", "content": user_content},
+                {"role": "assistant", "content": "{"},  # prefill：強制直接輸出 JSON 物件
+            ],
+            system=_single_post_system(single_post_prompt),
+        )
+        if message.stop_reason == "max_tokens":
+            raise ValueError("Claude 回應被截斷，貼文內容不完整")
+        raw = message.content[0].text
+        if not raw.lstrip().startswith("{"):
+            raw = "{" + raw  # 補回 prefill；模型若自行重複輸出 "{" 則不重複補
+    else:
+        raw = cached
+    item = _extract_json_from_claude(raw, start_char="{")
+    if cached is None:
+        await asyncio.to_thread(llm_cache.put, cache_key, raw)
 
     # Step 2: 生圖
     scene_prompt = item.get("scene_prompt", "lifestyle photo")
@@ -329,13 +536,10 @@ async def generate_single_post(
         camera_style=camera_style,
     )
 
-    # Step 3: Append 到現有排程
-    existing = load_schedule(persona_id)
-    next_day = max((p.get("day", 0) for p in existing), default=0) + 1
+    # Step 3: Append 到現有排程（day 由 append_post 在鎖內依現有排程決定）
     new_post = {
         **item,
         "post_id": str(uuid.uuid4()),
-        "day": next_day,
         "date": date,
         "image_url": image_url,
         "image_prompt": full_prompt,
@@ -344,11 +548,31 @@ async def generate_single_post(
         "scheduled_at": None,
         "job_id": None,
     }
-    save_schedule(persona_id, existing + [new_post])
-    logger.info(f"Single post generated for persona={persona_id} date={date} day={next_day} post_id={new_post['post_id']}")
+    new_post = await asyncio.to_thread(append_post, persona_id, new_post, True)
+    logger.info(f"Single post generated for persona={persona_id} date={date} day={new_post['day']} post_id={new_post['post_id']}")
     return new_post
 
 
+# 進行中的重繪：(persona_id, content_id, full_prompt) → Task。
+# 重複點擊或前端重送相同請求時共用同一次生成，不重複打 Replicate
+_inflight_regenerations: dict = {}
+
+
+async def _generate_once(key: tuple, **kwargs) -> Optional[str]:
+    """相同 key 的生成只執行一次，同時等待的呼叫端共享結果。
+
+    以 shield 等待：其中一個請求斷線取消時，不影響其他仍在等待的請求。
+    """
+    task = _inflight_regenerations.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_and_upload_image(**kwargs))
+        _inflight_regenerations[key] = task
+        task.add_done_callback(lambda _: _inflight_regenerations.pop(key, None))
+    else:
+        logger.info(f"Joining in-flight regeneration for content_id={key[1]}")
+    return await asyncio.shield(task)
+
+
 async def regenerate_content(
     content_id: str,
     scene_prompt: str,
@@ -359,21 +583,23 @@ async def regenerate_content(
     """一鍵重繪：正確重建 prompt 並帶入 face_image_url
     reference_image_url 僅用於場景/姿勢分析，人臉永遠使用 persona 原始臉照。
     """
+    async def load_persona_if_any():
+        return await asyncio.to_thread(load_persona, persona_id) if persona_id else None
+
+    # 讀 persona（丟到 thread）與分析參考圖場景（僅用於 prompt 增強，不影響人臉）彼此獨立，並行執行
+    persona_data, ref_scene_desc = await asyncio.gather(
+        load_persona_if_any(),
+        _analyze_reference_image(reference_image_url),
+    )
+
     face_image_url = ""
     base_prompt = "attractive person, high quality, realistic"
-    if persona_id:
-        persona_data = load_persona(persona_id)
-        if persona_data:
-            face_image_url = persona_data.reference_face_url or ""
-            base_prompt = (
-                (persona_data.appearance.image_prompt if persona_data.appearance else "")
-                or base_prompt
-            )
-
-    # 分析參考圖場景（僅用於 prompt 增強，不影響人臉）
-    ref_scene_desc = ""
-    if reference_image_url:
-        ref_scene_desc = await _analyze_reference_image(reference_image_url)
+    if persona_data:
+        face_image_url = persona_data.reference_face_url or ""
+        base_prompt = (
+            (persona_data.appearance.image_prompt if persona_data.appearance else "")
+            or base_prompt
+        )
 
     parts = [p for p in [scene_prompt, ref_scene_desc, instruction] if p]
     enhanced_scene = ", ".join(parts)
@@ -383,7 +609,8 @@ async def regenerate_content(
         scene_prompt=enhanced_scene,
         camera_style=camera_style,
     )
-    image_url = await _generate_and_upload_image(
+    image_url = await _generate_once(
+        (persona_id, content_id, full_prompt),
         full_prompt=full_prompt,
         face_image_url=face_image_url,
         persona_id=persona_id or "regen",
@@ -0,0 +1,57 @@
+"""
+LLM Response Cache
+------------------
+Claude 規劃結果的 exact-match 快取：相同 model + system prompt + 輸入內容 → 直接回傳上次的原始回應，
+省下整次 Claude 呼叫（延遲與 token 成本）。
+
+存成 data/llm_cache/{sha256}.json（{"response": ..., "ts": ...}），超過 LLM_CACHE_TTL 秒視為過期。
+LLM_CACHE_TTL 預設 0（停用）：同一人設重複生成時使用者通常期待新內容，只在開發 / 測試等
+重複請求多的環境開啟。
+"""
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.services import json_codec
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DIR = Path(__file__).parent.parent.parent / "data" / "llm_cache"
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "0"))
+
+
+def make_key(*parts: str) -> str:
+    """由 model / prompt / 輸入內容組出快取 key（各段以分隔字元串接，避免邊界碰撞）"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """取得未過期的快取回應；停用、不存在或已過期時回傳 None"""
+    if LLM_CACHE_TTL <= 0:
+        return None
+    file_path = STORAGE_DIR / f"{key}.json"
+    try:
+        entry = json_codec.loads(file_path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"LLM cache entry {key[:12]} unreadable: {e}")
+        return None
+
+    if time.time() - entry.get("ts", 0) > LLM_CACHE_TTL:
+        file_path.unlink(missing_ok=True)
+        return None
+    logger.info(f"LLM cache hit {key[:12]}")
+    return entry.get("response")
+
+
+def put(key: str, response: str) -> None:
+    """寫入快取（停用時不做事）"""
+    if LLM_CACHE_TTL <= 0:
+        return
+    STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    json_codec.dump_file(STORAGE_DIR / f"{key}.json", {"response": response, "ts": time.time()})
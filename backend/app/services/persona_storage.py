@@ -4,16 +4,20 @@ Persona Storage Service
 簡單的檔案存儲機制（暫不使用資料庫）
 每個 persona 存為獨立的 JSON 檔案：data/personas/{persona_id}.json
 """
-import json
 import re
 import os
+import threading
 from typing import List, Optional
 from pathlib import Path
 from app.models.persona import PersonaCard
+from app.services import json_codec
 
 # 存儲目錄
 STORAGE_DIR = Path(__file__).parent.parent.parent / "data" / "personas"
 
+# update_persona_fields 的讀-改-寫需整段互斥（在 to_thread 中執行時，請求間不再由事件迴圈串行化）
+_write_lock = threading.RLock()
+
 _UUID_RE = re.compile(
     r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
 )
@@ -41,8 +45,7 @@ def save_persona(persona_id: str, persona: PersonaCard) -> None:
     file_path = STORAGE_DIR / f"{persona_id}.json"
     
     # 轉換為 dict 並儲存
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(persona.model_dump(), f, ensure_ascii=False, indent=2)
+    json_codec.dump_file(file_path, persona.model_dump(), indent=True)
 
 
 def load_persona(persona_id: str) -> Optional[PersonaCard]:
@@ -60,12 +63,26 @@ def load_persona(persona_id: str) -> Optional[PersonaCard]:
     if not file_path.exists():
         return None
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = json_codec.loads(file_path.read_bytes())
     
     return PersonaCard(**data)
 
 
+def update_persona_fields(persona_id: str, updates: dict) -> Optional[PersonaCard]:
+    """部分更新 persona 欄位（load + model_copy + save 在同一把鎖內完成）
+
+    Returns:
+        更新後的 PersonaCard，若不存在則回傳 None
+    """
+    with _write_lock:
+        persona = load_persona(persona_id)
+        if not persona:
+            return None
+        updated = persona.model_copy(update=updates)
+        save_persona(persona_id, updated)
+        return updated
+
+
 def list_personas() -> List[PersonaCard]:
     """列出所有已儲存的 personas
     
@@ -77,8 +94,7 @@ def list_personas() -> List[PersonaCard]:
     
     for file_path in STORAGE_DIR.glob("*.json"):
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = json_codec.loads(file_path.read_bytes())
             personas.append(PersonaCard(**data))
         except Exception as e:
             # 跳過無效的 JSON 檔案
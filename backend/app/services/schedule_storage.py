@@ -28,15 +28,28 @@ Schema:
     }
   ]
 }
+
+async 呼叫端以 asyncio.to_thread 執行這些函式，避免檔案 I/O 卡住 event loop。
+「讀取 → 修改 → 寫回」的函式（append_post / update_post_fields）持有同一把鎖，
+不同 thread 同時改同一份排程時不會互相覆蓋。
 """
-import json
+import os
+import threading
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Optional
 
+from app.services import json_codec
+
 STORAGE_DIR = Path(__file__).parent.parent.parent / "data" / "schedules"
 
+# 排程檔每次存檔都整份重寫：預設輸出緊湊 JSON，設 DEBUG_PRETTY_JSON 時才縮排方便人工查看
+PRETTY_JSON = bool(os.getenv("DEBUG_PRETTY_JSON"))
+
+# RLock：update_post_fields / append_post 內部會再呼叫 load_schedule / save_schedule
+_lock = threading.RLock()
+
 
 def _ensure_dir():
     STORAGE_DIR.mkdir(parents=True, exist_ok=True)
@@ -54,6 +67,11 @@ def _assign_missing_post_ids(posts: List[dict]) -> tuple[List[dict], bool]:
 
 def save_schedule(persona_id: str, posts: List[dict]) -> None:
     """儲存排程（覆寫）。寫入前確保每篇有 post_id（不 mutate 原始 list）。"""
+    with _lock:
+        _save_schedule(persona_id, posts)
+
+
+def _save_schedule(persona_id: str, posts: List[dict]) -> None:
     _ensure_dir()
     posts_to_save = []
     for post in posts:
@@ -66,9 +84,7 @@ def save_schedule(persona_id: str, posts: List[dict]) -> None:
         "updated_at": datetime.now(timezone.utc).isoformat(),
         "posts": posts_to_save,
     }
-    (STORAGE_DIR / f"{persona_id}.json").write_text(
-        json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    json_codec.dump_file(STORAGE_DIR / f"{persona_id}.json", data, indent=PRETTY_JSON)
 
 
 def load_schedule(persona_id: str) -> List[dict]:
@@ -76,15 +92,29 @@ def load_schedule(persona_id: str) -> List[dict]:
     path = STORAGE_DIR / f"{persona_id}.json"
     if not path.exists():
         return []
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-        posts = data.get("posts", [])
-        posts, modified = _assign_missing_post_ids(posts)
-        if modified:
-            save_schedule(persona_id, posts)
-        return posts
-    except Exception:
-        return []
+    with _lock:
+        try:
+            data = json_codec.loads(path.read_bytes())
+            posts = data.get("posts", [])
+            posts, modified = _assign_missing_post_ids(posts)
+            if modified:
+                _save_schedule(persona_id, posts)
+            return posts
+        except Exception:
+            return []
+
+
+def append_post(persona_id: str, post: dict, assign_next_day: bool = False) -> dict:
+    """追加一篇貼文到排程末端，回傳實際寫入的 post。
+
+    assign_next_day=True 時以現有最大 day + 1 作為新貼文的 day。
+    """
+    with _lock:
+        posts = load_schedule(persona_id)
+        if assign_next_day:
+            post = {**post, "day": max((p.get("day") or 0 for p in posts), default=0) + 1}
+        _save_schedule(persona_id, posts + [post])
+    return post
 
 
 def get_post(persona_id: str, post_id: str) -> Optional[dict]:
@@ -97,16 +127,17 @@ def get_post(persona_id: str, post_id: str) -> Optional[dict]:
 
 def update_post_fields(persona_id: str, post_id: str, **kwargs) -> bool:
     """通用欄位更新（可一次更新多個欄位）。value=None 表示刪除該欄位。"""
-    posts = load_schedule(persona_id)
-    for post in posts:
-        if post.get("post_id") == post_id:
-            for k, v in kwargs.items():
-                if v is None:
-                    post.pop(k, None)
-                else:
-                    post[k] = v
-            save_schedule(persona_id, posts)
-            return True
+    with _lock:
+        posts = load_schedule(persona_id)
+        for post in posts:
+            if post.get("post_id") == post_id:
+                for k, v in kwargs.items():
+                    if v is None:
+                        post.pop(k, None)
+                    else:
+                        post[k] = v
+                _save_schedule(persona_id, posts)
+                return True
     return False
 
 
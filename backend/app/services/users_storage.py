@@ -14,13 +14,14 @@ Schema:
   "created_at": "2026-03-10T..."
 }
 """
-import json
 import re
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
+from app.services import json_codec
+
 STORAGE_DIR = Path(__file__).parent.parent.parent / "data" / "users"
 
 _UUID_RE = re.compile(
@@ -40,23 +41,20 @@ def _path(user_uuid: str) -> Path:
 
 def save_user(user: dict) -> None:
     _ensure_dir()
-    with open(_path(user["uuid"]), "w", encoding="utf-8") as f:
-        json.dump(user, f, ensure_ascii=False, indent=2)
+    json_codec.dump_file(_path(user["uuid"]), user, indent=True)
 
 
 def get_user_by_uuid(user_uuid: str) -> Optional[dict]:
     p = _path(user_uuid)
     if not p.exists():
         return None
-    with open(p, encoding="utf-8") as f:
-        return json.load(f)
+    return json_codec.loads(p.read_bytes())
 
 
 def get_user_by_email(email: str) -> Optional[dict]:
     _ensure_dir()
     for p in STORAGE_DIR.glob("*.json"):
-        with open(p, encoding="utf-8") as f:
-            user = json.load(f)
+        user = json_codec.loads(p.read_bytes())
         if user.get("email", "").lower() == email.lower():
             return user
     return None
@@ -80,8 +78,7 @@ def verify_email(token: str) -> Optional[dict]:
     """找到對應 verification_token 的 user，標記為已驗證並清除 token"""
     _ensure_dir()
     for p in STORAGE_DIR.glob("*.json"):
-        with open(p, encoding="utf-8") as f:
-            user = json.load(f)
+        user = json_codec.loads(p.read_bytes())
         if user.get("verification_token") == token:
             user["email_verified"] = True
             user["verification_token"] = None
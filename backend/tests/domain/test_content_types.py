@@ -213,7 +213,7 @@ class TestContentGenerationWithContentType:
 
                 # 验证使用了 entertainment（第一个预设类型）
                 call_args = mock_client.messages.create.call_args
-                system_prompt = call_args.kwargs.get('system', '')
+                system_prompt = "".join(block["text"] for block in call_args.kwargs["system"])
                 assert "娛樂互動" in system_prompt  # entertainment 对应的标签
         finally:
             delete_persona(persona_id)
@@ -262,7 +262,7 @@ class TestContentGenerationWithContentType:
 
                 # 验证使用了 educational
                 call_args = mock_client.messages.create.call_args
-                system_prompt = call_args.kwargs.get('system', '')
+                system_prompt = "".join(block["text"] for block in call_args.kwargs["system"])
                 assert "知識分享" in system_prompt
         finally:
             delete_persona(persona_id)
@@ -0,0 +1,60 @@
+"""
+Unit tests for comfyui_service.py
+Mocks the shared Replicate httpx client — no real Replicate calls.
+"""
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+
+def _make_mock_response(json_body: dict):
+    mock = MagicMock()
+    mock.status_code = 200
+    mock.content = json.dumps(json_body).encode("utf-8")
+    return mock
+
+
+class TestPollPrediction:
+    @pytest.mark.asyncio
+    async def test_returns_first_output_on_success(self):
+        from app.services import comfyui_service
+        responses = [
+            _make_mock_response({"status": "processing"}),
+            _make_mock_response({"status": "succeeded", "output": ["https://replicate.delivery/a.jpg"]}),
+        ]
+        sleep = AsyncMock()
+        with patch.object(comfyui_service._http, "get", new=AsyncMock(side_effect=responses)), \
+             patch("app.services.comfyui_service.asyncio.sleep", new=sleep):
+            result = await comfyui_service._poll_prediction("https://api.replicate.com/v1/predictions/x")
+
+        assert result == "https://replicate.delivery/a.jpg"
+        # 指數退避：第一次約 0.5s，第二次約 1s（各含最多 POLL_JITTER 的 jitter）
+        delays = [c.args[0] for c in sleep.call_args_list]
+        assert len(delays) == 2
+        for delay, base in zip(delays, (0.5, 1.0)):
+            assert base <= delay <= base + comfyui_service.POLL_JITTER
+
+    @pytest.mark.asyncio
+    async def test_failed_prediction_returns_none(self):
+        from app.services import comfyui_service
+        with patch.object(comfyui_service._http, "get",
+                          new=AsyncMock(return_value=_make_mock_response({"status": "failed", "error": "nsfw"}))), \
+             patch("app.services.comfyui_service.asyncio.sleep", new=AsyncMock()):
+            result = await comfyui_service._poll_prediction("https://api.replicate.com/v1/predictions/x")
+
+        assert result is None
+
+
+class TestMinIntervalLimiter:
+    @pytest.mark.asyncio
+    async def test_spaces_out_back_to_back_callers(self):
+        from app.services import comfyui_service
+        limiter = comfyui_service._MinIntervalLimiter(10.0)
+        sleep = AsyncMock()
+        with patch("app.services.comfyui_service.time.monotonic", return_value=100.0), \
+             patch("app.services.comfyui_service.asyncio.sleep", new=sleep):
+            for _ in range(3):
+                await limiter.wait()
+
+        # 第一個立即放行，之後每個預約下一個 10 秒時段
+        assert [c.args[0] for c in sleep.call_args_list] == [10.0, 20.0]
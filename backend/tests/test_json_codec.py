@@ -0,0 +1,78 @@
+"""
+Unit tests for json_codec.py
+orjson 與標準庫 fallback 必須產出相同語意的 JSON。
+"""
+import json
+import os
+import pytest
+
+
+SAMPLE = {"name": "林小晴 Clara Lin", "tags": ["冒險", "創意"], "n": 3}
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def codec(request, monkeypatch):
+    import app.services.json_codec as jc
+    if request.param == "stdlib":
+        monkeypatch.setattr(jc, "orjson", None)
+    elif jc.orjson is None:
+        pytest.skip("orjson not installed")
+    return jc
+
+
+def test_roundtrip(codec):
+    assert codec.loads(codec.dumps(SAMPLE)) == SAMPLE
+
+
+def test_dumps_keeps_unicode_unescaped(codec):
+    assert "林小晴".encode("utf-8") in codec.dumps(SAMPLE)
+
+
+def test_indent_output_is_stdlib_compatible(codec):
+    raw = codec.dumps(SAMPLE, indent=True).decode("utf-8")
+    assert raw == json.dumps(SAMPLE, ensure_ascii=False, indent=2)
+
+
+def test_loads_raises_json_decode_error(codec):
+    with pytest.raises(codec.JSONDecodeError):
+        codec.loads("{invalid: json}")
+
+
+def test_dump_file_replaces_atomically(codec, tmp_path):
+    target = tmp_path / "persona.json"
+    target.write_text("old", encoding="utf-8")
+    codec.dump_file(target, SAMPLE, indent=True)
+    assert json.loads(target.read_text(encoding="utf-8")) == SAMPLE
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_dump_file_cleans_up_on_failure(codec, tmp_path):
+    target = tmp_path / "persona.json"
+    with pytest.raises(TypeError):
+        codec.dump_file(target, {"bad": object()})
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_dump_file_concurrent_writers(codec, tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    target = tmp_path / "persona.json"
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: codec.dump_file(target, {"n": i}), range(200)))
+    assert json.loads(target.read_text(encoding="utf-8"))["n"] in range(200)
+    assert list(tmp_path.iterdir()) == [target]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX file modes")
+def test_dump_file_keeps_existing_mode(codec, tmp_path):
+    target = tmp_path / "persona.json"
+    target.write_text("old", encoding="utf-8")
+    os.chmod(target, 0o640)
+    codec.dump_file(target, SAMPLE)
+    assert target.stat().st_mode & 0o777 == 0o640
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX file modes")
+def test_dump_file_new_file_follows_umask(codec, tmp_path):
+    target = tmp_path / "persona.json"
+    codec.dump_file(target, SAMPLE)
+    assert target.stat().st_mode & 0o777 == 0o666 & ~codec._UMASK
@@ -9,9 +9,13 @@ from unittest.mock import AsyncMock, patch
 
 from app.services.life_stream_service import (
     _infer_camera_style,
+    _resolve_camera_style,
+    _resolve_seed,
     _extract_json_from_claude,
     _generate_and_upload_image,
+    _JsonArrayStream,
     _build_single_post_prompt,
+    _single_post_system,
     SCENE_PROMPT_QUALITY_GUIDE,
     SCHEDULE_PROMPT,
 )
@@ -47,6 +51,38 @@ class TestInferCameraStyle:
         # "bar" → night, "cafe" → indoor; night should win because it comes first
         assert _infer_camera_style("bar with cafe vibes") == "night"
 
+    def test_map_order_wins_over_position(self):
+        # "beach" 出現在 "night" 之前，但 SCENE_CAMERA_MAP 中 night 優先
+        assert _infer_camera_style("beach party late at night") == "night"
+
+    def test_keyword_inside_word_still_matches(self):
+        assert _infer_camera_style("Dancing in a crowded Nightclub") == "night"
+
+    def test_unicode_case_variants_do_not_raise(self):
+        assert _infer_camera_style("İndoor ſtudio shot") == "lifestyle"
+
+
+class TestResolvePlannedFields:
+    def test_uses_planned_camera_style(self):
+        assert _resolve_camera_style({"camera_style": "portrait"}, "night market") == "portrait"
+
+    def test_invalid_camera_style_falls_back_to_inference(self):
+        assert _resolve_camera_style({"camera_style": "cinematic"}, "night market") == "night"
+        assert _resolve_camera_style({}, "walking on beach") == "outdoor"
+
+    def test_seed_must_be_int(self):
+        assert _resolve_seed({"seed": 837261}, set()) == 837261
+        assert _resolve_seed({"seed": "837261"}, set()) == 42
+        assert _resolve_seed({"seed": True}, set()) == 42
+        assert _resolve_seed({}, set()) == 42
+
+    def test_repeated_seeds_are_replaced(self):
+        used = set()
+        seeds = [_resolve_seed({"seed": 1234}, used) for _ in range(3)]
+        assert seeds[0] == 1234
+        assert len(set(seeds)) == 3
+        assert used == set(seeds)
+
 
 # ---------------------------------------------------------------------------
 # _extract_json_from_claude — pure function
@@ -81,6 +117,52 @@ class TestExtractJsonFromClaude:
         with pytest.raises(ValueError):
             _extract_json_from_claude("{invalid: json}", start_char="{")
 
+    def test_ignores_trailing_prose_and_braces_in_strings(self):
+        raw = '{"caption": "早安 {x} [y] \\"q\\""}\n\n以上是規劃 {完}'
+        result = _extract_json_from_claude(raw, start_char="{")
+        assert result["caption"] == '早安 {x} [y] "q"'
+
+    def test_truncated_array_raises(self):
+        raw = '```json\n[{"day": 1, "tags": ["#a"]}, {"day": 2, "tags": ["#b"'
+        with pytest.raises(ValueError, match="未閉合"):
+            _extract_json_from_claude(raw, start_char="[")
+
+    def test_truncation_inside_string_raises(self):
+        with pytest.raises(ValueError, match="未閉合"):
+            _extract_json_from_claude('{"scene": "cafe", "caption": "今天去了一家很棒的咖啡', start_char="{")
+
+
+# ---------------------------------------------------------------------------
+# _JsonArrayStream — incremental array parser for streamed responses
+# ---------------------------------------------------------------------------
+
+class TestJsonArrayStream:
+    RAW = '```json\n[{"day": 1, "caption": "早安 {x} [y] \\"q\\""}, {"day": 2, "tags": ["#a"]}]\n```'
+
+    def test_yields_each_item_once_complete(self):
+        scanner = _JsonArrayStream()
+        assert scanner.feed(self.RAW[:40]) == []
+        items = scanner.feed(self.RAW[40:])
+        assert [i["day"] for i in items] == [1, 2]
+        assert items[0]["caption"] == '早安 {x} [y] "q"'
+        assert scanner.count == 2
+
+    def test_char_by_char_matches_full_parse(self):
+        scanner = _JsonArrayStream()
+        items = [item for ch in self.RAW for item in scanner.feed(ch)]
+        assert items == _extract_json_from_claude(self.RAW, start_char="[")
+
+    def test_raises_on_invalid_item(self):
+        with pytest.raises(ValueError, match="JSON 格式錯誤"):
+            _JsonArrayStream().feed('[{invalid: json}]')
+
+    def test_closed_only_after_array_end(self):
+        scanner = _JsonArrayStream()
+        scanner.feed('[{"day": 1}, {"day": 2')
+        assert scanner.count == 1 and not scanner.closed
+        scanner.feed('}]\n```\n{"ignored": true}')
+        assert scanner.count == 2 and scanner.closed
+
 
 # ---------------------------------------------------------------------------
 # SCENE_PROMPT_QUALITY_GUIDE — shared constant
@@ -115,6 +197,11 @@ class TestScenePromptQualityGuide:
         assert "知識分享" in single_post_prompt_edu, \
             "SINGLE_POST_PROMPT should include content type description"
 
+    def test_single_post_system_marks_prompt_cacheable(self):
+        prompt = _build_single_post_prompt("educational")
+        system = _single_post_system(prompt)
+        assert system == [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+
 
 # ---------------------------------------------------------------------------
 # _generate_and_upload_image — async, external deps mocked
@@ -4,6 +4,7 @@ test_life_stream_service.py
 重點驗收：generate_weekly_schedule 不再依賴前端傳入的 persona dict，
 改為自己從 persona_storage 讀取。
 """
+import asyncio
 import json
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -35,6 +36,29 @@ def _make_persona_card(persona_id: str = "test123") -> PersonaCard:
     )
 
 
+class _FakeStream:
+    """模擬 client.messages.stream(...) 的 async context manager，把文字切成小段逐段吐出。"""
+
+    def __init__(self, text: str, chunk_size: int = 16):
+        self._chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _stream_returning(text: str) -> MagicMock:
+    """text 為 assistant prefill "[" 之後的續寫內容（即完整回應去掉開頭的 "["）"""
+    return MagicMock(side_effect=lambda **kwargs: _FakeStream(text))
+
+
 # --------------------------------------------------------------------------- #
 # Test: persona loaded from storage (no persona arg)
 # --------------------------------------------------------------------------- #
@@ -50,12 +74,11 @@ async def test_generate_schedule_loads_persona_from_storage():
         {"day": 3, "scene": "夜市", "caption": "宵夜", "scene_prompt": "night market scene", "hashtags": []},
     ]
 
-    mock_message = MagicMock()
-    mock_message.content = [MagicMock(text=json.dumps(fake_schedule))]
+    mock_stream = _stream_returning(json.dumps(fake_schedule)[1:])
 
     with (
         patch("app.services.life_stream_service.load_persona", return_value=persona_card) as mock_load,
-        patch("app.services.life_stream_service.client.messages.create", new=AsyncMock(return_value=mock_message)),
+        patch("app.services.life_stream_service.client.messages.stream", new=mock_stream),
         patch("app.services.comfyui_service.generate_image", new=AsyncMock(return_value="https://replicate.delivery/test.jpg")),
         patch("app.services.comfyui_service.build_realism_prompt", return_value="full prompt"),
         patch("app.services.life_stream_service.upload_from_url", new=AsyncMock(return_value="https://cloudinary.com/test.jpg")),
@@ -69,6 +92,8 @@ async def test_generate_schedule_loads_persona_from_storage():
     mock_load.assert_called_once_with("user_001")
     assert result["persona_id"] == "user_001"
     assert len(result["schedule"]) == 3
+    # 以 assistant prefill "[" 強制 JSON 輸出
+    assert mock_stream.call_args.kwargs["messages"][-1] == {"role": "assistant", "content": "["}
 
 
 @pytest.mark.asyncio
@@ -93,9 +118,6 @@ async def test_generate_schedule_uses_appearance_prompt_fallback():
         {"day": i, "scene": "s", "caption": "c", "scene_prompt": "sp", "hashtags": []}
         for i in range(1, 4)
     ]
-    mock_message = MagicMock()
-    mock_message.content = [MagicMock(text=json.dumps(fake_schedule))]
-
     captured_prompts = []
 
     def capture_build_prompt(character_desc, scene_prompt, camera_style):
@@ -104,7 +126,7 @@ async def test_generate_schedule_uses_appearance_prompt_fallback():
 
     with (
         patch("app.services.life_stream_service.load_persona", return_value=persona_card),
-        patch("app.services.life_stream_service.client.messages.create", new=AsyncMock(return_value=mock_message)),
+        patch("app.services.life_stream_service.client.messages.stream", new=_stream_returning(json.dumps(fake_schedule)[1:])),
         patch("app.services.comfyui_service.generate_image", new=AsyncMock(return_value=None)),
         patch("app.services.comfyui_service.build_realism_prompt", side_effect=capture_build_prompt),
         patch("app.services.life_stream_service.save_schedule"),
@@ -120,3 +142,116 @@ async def test_generate_schedule_uses_appearance_prompt_fallback():
         captured_prompts.clear()
         await generate_weekly_schedule(persona_id="test123")
         assert all("young woman" in p for p in captured_prompts)
+
+
+# --------------------------------------------------------------------------- #
+# Test: identical in-flight regenerations share one generation
+# --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+async def test_regenerate_coalesces_identical_inflight_requests():
+    release = asyncio.Event()
+    calls = []
+
+    async def fake_generate(**kwargs):
+        calls.append(kwargs)
+        await release.wait()
+        return "https://cloudinary.com/regen.jpg"
+
+    with (
+        patch("app.services.life_stream_service.load_persona", return_value=_make_persona_card()),
+        patch("app.services.life_stream_service._generate_and_upload_image", new=fake_generate),
+        patch("app.services.comfyui_service.build_realism_prompt", return_value="full prompt"),
+    ):
+        from app.services.life_stream_service import regenerate_content, _inflight_regenerations
+        kwargs = dict(content_id="c1", scene_prompt="cafe", persona_id="test123")
+        first = asyncio.create_task(regenerate_content(**kwargs))
+        second = asyncio.create_task(regenerate_content(**kwargs))
+        while not calls:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(first, second)
+
+    assert len(calls) == 1
+    assert [r["image_url"] for r in results] == ["https://cloudinary.com/regen.jpg"] * 2
+    assert not _inflight_regenerations
+
+
+# --------------------------------------------------------------------------- #
+# Test: truncated plan / assistant prefill handling
+# --------------------------------------------------------------------------- #
+
+@pytest.mark.asyncio
+async def test_generate_schedule_rejects_truncated_plan():
+    """串流在陣列收尾前結束（max_tokens 截斷）時應報錯，而不是回傳少了幾天的排程。"""
+    truncated = json.dumps([{"day": 1, "scene_prompt": "cafe"}, {"day": 2, "scene_prompt": "park"}])[1:-30]
+    save = MagicMock()
+
+    with (
+        patch("app.services.life_stream_service.load_persona", return_value=_make_persona_card()),
+        patch("app.services.life_stream_service.client.messages.stream", new=_stream_returning(truncated)),
+        patch("app.services.life_stream_service._generate_and_upload_image", new=AsyncMock(return_value=None)),
+        patch("app.services.life_stream_service.save_schedule", new=save),
+    ):
+        from app.services.life_stream_service import generate_weekly_schedule
+        with pytest.raises(ValueError, match="截斷"):
+            await generate_weekly_schedule(persona_id="test123")
+
+    save.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_generate_single_post_prepends_prefill():
+    """Claude 回應是 prefill "{" 之後的續寫，解析前要補回 "{"。"""
+    continuation = '"scene": "咖啡廳", "caption": "早安", "scene_prompt": "cafe", "hashtags": []}'
+
+    with (
+        patch("app.services.life_stream_service.load_persona", return_value=_make_persona_card()),
+        patch("app.services.life_stream_service.client.messages.create",
+              new=AsyncMock(return_value=MagicMock(content=[MagicMock(text=continuation)]))),
+        patch("app.services.life_stream_service._generate_and_upload_image", new=AsyncMock(return_value=None)),
+        patch("app.services.life_stream_service.append_post", side_effect=lambda pid, post, _: {**post, "day": 1}),
+    ):
+        from app.services.life_stream_service import generate_single_post
+        post = await generate_single_post(persona_id="test123", date="2026-04-01")
+
+    assert post["scene"] == "咖啡廳"
+
+
+@pytest.mark.asyncio
+async def test_generate_single_post_rejects_max_tokens_cut():
+    """單篇回應因 max_tokens 停止時應報錯，不寫入 llm_cache，也不 append 到排程。"""
+    message = MagicMock(content=[MagicMock(text='"caption": "今天去了一家很棒的咖啡')], stop_reason="max_tokens")
+    append = MagicMock()
+    cache_put = MagicMock()
+
+    with (
+        patch("app.services.life_stream_service.load_persona", return_value=_make_persona_card()),
+        patch("app.services.life_stream_service.client.messages.create", new=AsyncMock(return_value=message)),
+        patch("app.services.life_stream_service.llm_cache.get", return_value=None),
+        patch("app.services.life_stream_service.llm_cache.put", new=cache_put),
+        patch("app.services.life_stream_service.append_post", new=append),
+    ):
+        from app.services.life_stream_service import generate_single_post
+        with pytest.raises(ValueError, match="截斷"):
+            await generate_single_post(persona_id="test123", date="2026-04-01")
+
+    cache_put.assert_not_called()
+    append.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_generate_schedule_surfaces_original_day_failure():
+    """某天生成失敗時拋出原始例外，而不是 TaskGroup 的 ExceptionGroup。"""
+    fake_schedule = [{"day": i, "scene_prompt": "sp"} for i in range(1, 4)]
+
+    with (
+        patch("app.services.life_stream_service.load_persona", return_value=_make_persona_card()),
+        patch("app.services.life_stream_service.client.messages.stream", new=_stream_returning(json.dumps(fake_schedule)[1:])),
+        patch("app.services.comfyui_service.build_realism_prompt", side_effect=RuntimeError("boom")),
+        patch("app.services.life_stream_service.save_schedule"),
+    ):
+        from app.services.life_stream_service import generate_weekly_schedule
+        with pytest.raises(RuntimeError, match="boom"):
+            await generate_weekly_schedule(persona_id="test123")
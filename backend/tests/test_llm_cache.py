@@ -0,0 +1,42 @@
+"""
+Unit tests for llm_cache.py
+使用 tmp_path 當快取目錄，不碰真正的 data/llm_cache。
+"""
+import pytest
+
+from app.services import llm_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "STORAGE_DIR", tmp_path / "llm_cache")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_TTL", 60)
+    return llm_cache
+
+
+def test_roundtrip(cache):
+    key = cache.make_key("model", "system", "persona")
+    assert cache.get(key) is None
+    cache.put(key, '[{"day": 1}]')
+    assert cache.get(key) == '[{"day": 1}]'
+
+
+def test_key_depends_on_every_part(cache):
+    assert cache.make_key("a", "bc") != cache.make_key("ab", "c")
+    assert cache.make_key("m", "s", "p1") != cache.make_key("m", "s", "p2")
+
+
+def test_expired_entry_is_dropped(cache, monkeypatch):
+    key = cache.make_key("k")
+    cache.put(key, "old")
+    monkeypatch.setattr(cache.time, "time", lambda: 10**12)
+    assert cache.get(key) is None
+    assert not (cache.STORAGE_DIR / f"{key}.json").exists()
+
+
+def test_disabled_when_ttl_is_zero(cache, monkeypatch):
+    monkeypatch.setattr(cache, "LLM_CACHE_TTL", 0)
+    key = cache.make_key("k")
+    cache.put(key, "value")
+    assert cache.get(key) is None
+    assert not cache.STORAGE_DIR.exists()
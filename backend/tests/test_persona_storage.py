@@ -0,0 +1,75 @@
+"""
+Unit tests for persona_storage.py
+Uses a temporary directory — no external services needed.
+"""
+import uuid
+import pytest
+
+from app.models.persona import PersonaCard
+
+
+@pytest.fixture
+def tmp_storage(tmp_path, monkeypatch):
+    """Redirect STORAGE_DIR to a temp directory."""
+    import app.services.persona_storage as ps
+    monkeypatch.setattr(ps, "STORAGE_DIR", tmp_path)
+    yield tmp_path
+
+
+def _persona(name: str = "林小晴") -> PersonaCard:
+    return PersonaCard(
+        name=name,
+        occupation="咖啡師",
+        personality_tags=["溫柔"],
+        speech_pattern="casual",
+        values=["真誠"],
+        weekly_lifestyle="咖啡廳打工",
+    )
+
+
+class TestLoadPersona:
+    def test_missing_persona_returns_none(self, tmp_storage):
+        from app.services import persona_storage as ps
+        assert ps.load_persona(str(uuid.uuid4())) is None
+
+    def test_save_then_load_sees_latest(self, tmp_storage):
+        from app.services import persona_storage as ps
+        pid = str(uuid.uuid4())
+        ps.save_persona(pid, _persona())
+        ps.save_persona(pid, _persona("Clara"))
+        assert ps.load_persona(pid).name == "Clara"
+
+    def test_delete_removes_persona(self, tmp_storage):
+        from app.services import persona_storage as ps
+        pid = str(uuid.uuid4())
+        ps.save_persona(pid, _persona())
+        assert ps.delete_persona(pid) is True
+        assert ps.load_persona(pid) is None
+
+
+class TestListPersonas:
+    def test_reflects_saves_and_deletes(self, tmp_storage):
+        from app.services import persona_storage as ps
+        a, b = str(uuid.uuid4()), str(uuid.uuid4())
+        ps.save_persona(a, _persona("A"))
+        ps.save_persona(b, _persona("B"))
+        assert sorted(p.name for p in ps.list_personas()) == ["A", "B"]
+
+        ps.save_persona(a, _persona("A2"))
+        ps.delete_persona(b)
+        assert [p.name for p in ps.list_personas()] == ["A2"]
+
+
+class TestUpdatePersonaFields:
+    def test_missing_persona_returns_none(self, tmp_storage):
+        from app.services import persona_storage as ps
+        assert ps.update_persona_fields(str(uuid.uuid4()), {"name": "X"}) is None
+
+    def test_partial_update_keeps_other_fields(self, tmp_storage):
+        from app.services import persona_storage as ps
+        pid = str(uuid.uuid4())
+        ps.save_persona(pid, _persona())
+        updated = ps.update_persona_fields(pid, {"occupation": "插畫家"})
+        assert updated.occupation == "插畫家"
+        reloaded = ps.load_persona(pid)
+        assert (reloaded.name, reloaded.occupation) == ("林小晴", "插畫家")
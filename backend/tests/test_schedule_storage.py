@@ -54,6 +54,13 @@ class TestSaveAndLoad:
         assert len(data["posts"]) == len(SAMPLE_POSTS)
         assert data["posts"][0]["post_id"] == "pid-1"
 
+    def test_file_is_compact_and_written_atomically(self, tmp_storage):
+        from app.services.schedule_storage import save_schedule
+        save_schedule("persona_4", SAMPLE_POSTS)
+        raw = (tmp_storage / "persona_4.json").read_text(encoding="utf-8")
+        assert "\n" not in raw
+        assert [p.name for p in tmp_storage.iterdir()] == ["persona_4.json"]
+
     def test_load_ignores_corrupted_file(self, tmp_storage):
         from app.services.schedule_storage import load_schedule
         (tmp_storage / "bad.json").write_text("not json", encoding="utf-8")
@@ -132,3 +139,20 @@ class TestUpdatePostFields:
         post3 = next(p for p in posts if p["post_id"] == "pid-3")
         assert post3["scheduled_at"] == "2026-03-10T09:00:00Z"
         assert post3["job_id"] == "job-abc"
+
+
+class TestAppendPost:
+    def test_append_assigns_next_day(self, tmp_storage):
+        from app.services.schedule_storage import save_schedule, append_post, load_schedule
+        save_schedule("persona_11", SAMPLE_POSTS + [{"post_id": "chat", "day": None}])
+        post = append_post("persona_11", {"post_id": "pid-4", "caption": "新貼文"}, assign_next_day=True)
+        assert post["day"] == 4
+        assert load_schedule("persona_11")[-1] == post
+
+    def test_concurrent_appends_are_not_lost(self, tmp_storage):
+        from concurrent.futures import ThreadPoolExecutor
+        from app.services.schedule_storage import append_post, load_schedule
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: append_post("persona_12", {"post_id": f"p{i}"}, True), range(20)))
+        posts = load_schedule("persona_12")
+        assert sorted(p["day"] for p in posts) == list(range(1, 21))